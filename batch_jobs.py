@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Batch jobs - chay cac job bao tri bo nho qua Batch API
+
+Cac job offline (review_memories, optimize_memory, compress_old_conversations)
+duoc goi theo format OpenAI Batch API / Anthropic Message Batches, submit,
+poll dinh ky va apply ket qua vao memory store khi xong.
+
+Chay:
+  python batch_jobs.py --list    # Xem danh sach batch jobs
+"""
+
+import os
+import json
+import sys
+import datetime
+import uuid
+
+from providers import split_system, openai_response_format, claude_tool_params, claude_text
+
+BATCH_STATE_FILE = "batch_jobs.json"
+
+# Trạng thái chung cho mọi provider
+STATUS_PENDING = "pending"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+
+# ============================================
+# PROVIDERS
+# ============================================
+# Mỗi request là dict: {"custom_id": str, "messages": [...], "max_tokens": int}
+# và có thể có "schema" (xem providers.py) để bật structured output
+
+class OpenAIBatchProvider:
+    """OpenAI Batch API - upload file JSONL rồi tạo batch /v1/chat/completions"""
+    name = "openai"
+
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+
+    def submit(self, requests):
+        lines = []
+        for req in requests:
+            body = {
+                "model": self.model,
+                "messages": req["messages"],
+                "max_completion_tokens": req["max_tokens"]
+            }
+            if req.get("schema"):
+                body["response_format"] = openai_response_format(req["schema"])
+            lines.append(json.dumps({
+                "custom_id": req["custom_id"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body
+            }, ensure_ascii=False))
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+        batch_file = self.client.files.create(file=("batch.jsonl", payload), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status == "completed":
+            return STATUS_COMPLETED
+        # Batch hết hạn/bị hủy vẫn có thể có kết quả một phần
+        if batch.status in ("expired", "cancelled") and batch.output_file_id:
+            return STATUS_COMPLETED
+        if batch.status in ("failed", "expired", "cancelled"):
+            return STATUS_FAILED
+        return STATUS_PENDING
+
+    def results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        results = {}
+        if not batch.output_file_id:
+            return results
+        content = self.client.files.content(batch.output_file_id).text
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            results[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return results
+
+    def cancel(self, batch_id):
+        self.client.batches.cancel(batch_id)
+
+
+class AnthropicBatchProvider:
+    """Anthropic Message Batches API"""
+    name = "claude"
+
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+
+    def submit(self, requests):
+        batch_requests = []
+        for req in requests:
+            system_content, chat_messages = split_system(req["messages"])
+            params = {
+                "model": self.model,
+                "max_tokens": req["max_tokens"],
+                "system": system_content,
+                "messages": chat_messages
+            }
+            if req.get("schema"):
+                params.update(claude_tool_params(req["schema"]))
+            batch_requests.append({"custom_id": req["custom_id"], "params": params})
+        batch = self.client.messages.batches.create(requests=batch_requests)
+        return batch.id
+
+    def status(self, batch_id):
+        batch = self.client.messages.batches.retrieve(batch_id)
+        if batch.processing_status == "ended":
+            return STATUS_COMPLETED
+        return STATUS_PENDING
+
+    def results(self, batch_id):
+        results = {}
+        for item in self.client.messages.batches.results(batch_id):
+            if item.result.type == "succeeded":
+                results[item.custom_id] = claude_text(item.result.message.content)
+        return results
+
+    def cancel(self, batch_id):
+        self.client.messages.batches.cancel(batch_id)
+
+
+class MockBatchProvider:
+    """Provider giả lập chạy local để test
+
+    responder(request) -> text; mặc định trả về chuỗi rỗng.
+    Batch chỉ "xong" sau `polls_until_done` lần gọi status().
+    """
+    name = "mock"
+
+    def __init__(self, responder=None, polls_until_done=1):
+        self.responder = responder or (lambda request: "")
+        self.polls_until_done = polls_until_done
+        self.batches = {}
+
+    def submit(self, requests):
+        batch_id = f"mock_{uuid.uuid4().hex[:12]}"
+        self.batches[batch_id] = {"requests": list(requests), "polls": 0, "cancelled": False}
+        return batch_id
+
+    def status(self, batch_id):
+        batch = self.batches.get(batch_id)
+        # Mock không lưu qua restart -> batch cũ coi như failed
+        if batch is None or batch["cancelled"]:
+            return STATUS_FAILED
+        batch["polls"] += 1
+        if batch["polls"] >= self.polls_until_done:
+            return STATUS_COMPLETED
+        return STATUS_PENDING
+
+    def results(self, batch_id):
+        batch = self.batches.pop(batch_id, None)
+        if batch is None:
+            return {}
+        results = {}
+        for req in batch["requests"]:
+            try:
+                results[req["custom_id"]] = self.responder(req)
+            except Exception as e:
+                print(f"[Batch] Mock responder error ({req['custom_id']}): {e}")
+        return results
+
+    def cancel(self, batch_id):
+        if batch_id in self.batches:
+            self.batches[batch_id]["cancelled"] = True
+
+
+# ============================================
+# JOB RUNNER
+# ============================================
+class BatchJobRunner:
+    """Quản lý batch jobs: submit, poll, apply kết quả qua handler theo `kind`
+
+    Trạng thái jobs được lưu vào file JSON để poll tiếp sau khi restart.
+    """
+
+    def __init__(self, provider, state_file=BATCH_STATE_FILE):
+        self.provider = provider
+        self.state_file = state_file
+        self.handlers = {}
+        self.state = load_state(state_file)
+
+    def register(self, kind, handler):
+        """handler(job, results) - results là dict {custom_id: text}"""
+        self.handlers[kind] = handler
+
+    def save(self):
+        with open(self.state_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+
+    def submit(self, kind, requests, meta=None):
+        """Gửi một batch job, trả về job record"""
+        batch_id = self.provider.submit(requests)
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "provider": self.provider.name,
+            "batch_id": batch_id,
+            "status": STATUS_PENDING,
+            "created_at": datetime.datetime.now().isoformat(),
+            "completed_at": None,
+            "request_count": len(requests),
+            "meta": meta or {}
+        }
+        self.state["jobs"].append(job)
+        self.save()
+        print(f"[Batch] Submitted {kind} job {job['id'][:8]} ({len(requests)} requests)")
+        return job
+
+    def pending_jobs(self):
+        return [job for job in self.state["jobs"]
+                if job["status"] == STATUS_PENDING and job["provider"] == self.provider.name]
+
+    def check(self):
+        """Poll provider (chỉ gọi network, không sửa state)
+
+        Trả về list (job, results); results là None nếu batch failed.
+        An toàn để chạy trong thread riêng.
+        """
+        finished = []
+        for job in self.pending_jobs():
+            try:
+                status = self.provider.status(job["batch_id"])
+                if status == STATUS_COMPLETED:
+                    finished.append((job, self.provider.results(job["batch_id"])))
+                elif status == STATUS_FAILED:
+                    finished.append((job, None))
+            except Exception as e:
+                print(f"[Batch] Poll error ({job['id'][:8]}): {e}")
+        return finished
+
+    def apply(self, job, results):
+        """Apply kết quả của job đã xong qua handler đã đăng ký"""
+        job["completed_at"] = datetime.datetime.now().isoformat()
+        if results is None:
+            job["status"] = STATUS_FAILED
+            print(f"[Batch] Job {job['id'][:8]} ({job['kind']}) failed")
+        else:
+            handler = self.handlers.get(job["kind"])
+            try:
+                if handler:
+                    handler(job, results)
+                job["status"] = "applied"
+                print(f"[Batch] Applied {job['kind']} job {job['id'][:8]} ({len(results)}/{job['request_count']} results)")
+            except Exception as e:
+                job["status"] = STATUS_FAILED
+                job["error"] = str(e)
+                print(f"[Batch] Apply error ({job['id'][:8]}): {e}")
+        self.save()
+
+    def poll(self):
+        """check() + apply() trong cùng thread"""
+        finished = self.check()
+        for job, results in finished:
+            self.apply(job, results)
+        return len(finished)
+
+    def cancel(self, job_id):
+        for job in self.state["jobs"]:
+            if job["id"].startswith(job_id) and job["status"] == STATUS_PENDING:
+                self.provider.cancel(job["batch_id"])
+                job["status"] = "cancelled"
+                self.save()
+                return job
+        return None
+
+
+def load_state(state_file=BATCH_STATE_FILE):
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except:
+            pass
+    return {"jobs": []}
+
+
+# ============================================
+# MAIN
+# ============================================
+def list_jobs():
+    jobs = load_state()["jobs"]
+    if not jobs:
+        print("Chua co batch job nao")
+        return
+    print(f"{'ID':10} {'KIND':10} {'PROVIDER':8} {'STATUS':10} {'REQ':>4}  CREATED")
+    for job in jobs:
+        print(f"{job['id'][:8]:10} {job['kind']:10} {job['provider']:8} {job['status']:10} "
+              f"{job['request_count']:>4}  {job['created_at'][:19]}")
+
+
+if __name__ == "__main__":
+    if "--list" in sys.argv or len(sys.argv) == 1:
+        list_jobs()
+    else:
+        print(__doc__)
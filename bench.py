@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Bench - do toc do memory store, ghi file va dung prompt
+
+Prompt duoc dung giong bot: fragments bo nho + few-shot (training_data/whitecat)
++ rolling summary thay cho phan history da tom tat.
+
+Tao store gia lap (1k/10k/100k ky uc, nhieu user/channel) trong thu muc tam,
+do tung thao tac voi LLM gia (khong goi mang, khong can API key) va ghi ket qua
+ra JSON. Neu co baseline thi so sanh: cham hon baseline qua nguong -> regression.
+
+Chay:
+  python bench.py                          # Chay 1k/10k/100k, so voi bench_baseline.json neu co
+  python bench.py --sizes 1000,10000       # Chi chay mot so kich thuoc
+  python bench.py --save-baseline          # Ghi ket qua lam baseline moi
+  python bench.py --threshold 0.25         # Cham hon baseline >25% -> regression (exit 1)
+"""
+
+import os
+import io
+import json
+import sys
+import argparse
+import contextlib
+import datetime
+import platform
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+from fewshot import FewShotIndex
+from memory_store import MemoryStore
+from message_tags import parse_msg_tags
+from providers import parse_json_loose
+from reply_prompt import (
+    RESPONSE_RULES, format_context, build_reply_messages, format_fewshot, split_history, estimate_tokens
+)
+
+BASELINE_FILE = "bench_baseline.json"
+RESULTS_FILE = "bench_results.json"
+DEFAULT_SIZES = [1000, 10000, 100000]
+FEWSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "training_data", "whitecat")
+# Giống default của bot
+FEWSHOT_TOKEN_BUDGET = 300
+FEWSHOT_MAX_EXAMPLES = 2
+SUMMARY_RAW_WINDOW = 10
+
+WORDS = ("thich an uong ngu hoc code game nhac phim meo cho gau di choi sinh nhat thi cu "
+         "buon vui met lam viec du lich ban be gia dinh nguoi yeu mua sam the thao bong da "
+         "doc sach ve tranh nau an cafe tra sua dem khuya sang som deadline project python "
+         "discord server bot chuyen cu ky niem muc tieu van de lo lang ho tro").split()
+IMPORTANCE = ("high", "medium", "medium", "low")
+TAGS = ("emotion", "event", "personal_info", "relationship")
+
+
+class MockLLM:
+    """LLM giả cùng interface với providers: complete() -> (text, usage), không gọi mạng"""
+    name = "mock"
+    model = "mock"
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def complete(self, messages, max_tokens, model=None, schema=None):
+        content = " ".join(self.rng.choice(WORDS) for _ in range(12))
+        text = json.dumps({"important": True, "content": content, "tags": ["personal_info"],
+                           "importance": "medium"}, ensure_ascii=False)
+        return text, {"prompt_tokens": sum(len(m["content"]) for m in messages) // 3, "completion_tokens": 40}
+
+
+# ============================================
+# DỮ LIỆU GIẢ LẬP
+# ============================================
+def random_text(rng, low=8, high=20):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def make_store(tmp_dir, size, rng):
+    """Store với `size` ký ức, ~size/20 user và ~size/500 channel"""
+    user_ids = [str(10**17 + i) for i in range(max(size // 20, 50))]
+    channel_ids = [str(9 * 10**17 + i) for i in range(max(size // 500, 5))]
+    now = datetime.datetime.now()
+
+    store = MemoryStore(
+        long_term_file=os.path.join(tmp_dir, "long_term_memory.json"),
+        memories_file=os.path.join(tmp_dir, "user_memories.json"),
+        logs_dir=os.path.join(tmp_dir, "conversation_logs"),
+        cold_file=os.path.join(tmp_dir, "long_term_memory_cold.jsonl"),
+        tombstone_file=os.path.join(tmp_dir, "long_term_memory_tombstones.jsonl")
+    )
+    os.makedirs(store.logs_dir, exist_ok=True)
+
+    memories = []
+    for i in range(size):
+        users = [] if rng.random() < 0.1 else rng.sample(user_ids, rng.choice((1, 1, 1, 2)))
+        names = {uid: f"user{uid[-4:]}" for uid in users}
+        memories.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "timestamp": (now - datetime.timedelta(minutes=rng.randint(0, 90 * 24 * 60))).isoformat(),
+            "users": users,
+            "user_names": dict(names),
+            "original_names": dict(names),
+            "content": f"{random_text(rng)} #{i}",
+            "importance": rng.choice(IMPORTANCE),
+            "tags": [rng.choice(TAGS)],
+            "channel_id": rng.choice(channel_ids),
+            "hits": rng.randint(0, 20)
+        })
+    store.long_term_memory["memories"] = memories
+    for uid in rng.sample(user_ids, min(len(user_ids), 200)):
+        store.user_memories[uid] = {"so_thich": random_text(rng, 2, 4), "ten_that": f"ten{uid[-3:]}"}
+    return store, user_ids, channel_ids
+
+
+def make_history(rng, user_ids, length=60):
+    history = []
+    for _ in range(length // 2):
+        buffer = [(f"user{uid[-4:]}", random_text(rng, 3, 15), uid, None)
+                  for uid in rng.sample(user_ids, rng.randint(1, 3))]
+        history.append({"role": "user", "content": format_context(buffer)[0]})
+        history.append({"role": "assistant", "content": random_text(rng, 5, 30)})
+    return history
+
+
+# ============================================
+# ĐO
+# ============================================
+def measure(fn, runs):
+    """Chạy fn() `runs` lần, trả về thống kê thời gian (ms)"""
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(runs):
+            start = time.perf_counter()
+            fn(i)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "runs": runs,
+        "median_ms": round(statistics.median(timings), 4),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+        "max_ms": round(timings[-1], 4)
+    }
+
+
+def bench_size(size, seed=42):
+    rng = random.Random(seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store, user_ids, channel_ids = make_store(tmp_dir, size, rng)
+        history = make_history(rng, user_ids)
+        llm = MockLLM(rng)
+        heavy_runs = 3 if size >= 100000 else 5
+        with contextlib.redirect_stdout(io.StringIO()):
+            fewshot_index = FewShotIndex(estimate_tokens).load(FEWSHOT_DIR)
+        # Rolling summary đã phủ 40 message đầu -> prompt chỉ gửi tóm tắt + 20 message cuối
+        summary_state = {"text": random_text(rng, 150, 200), "covered": len(history) - 20}
+
+        results["rebuild_index"] = measure(lambda i: store.rebuild_memory_index(), heavy_runs)
+
+        user_batches = [rng.sample(user_ids, rng.randint(1, 4)) for _ in range(200)]
+        results["get_relevant_memories"] = measure(
+            lambda i: store.get_relevant_memories(user_batches[i], limit=10, count_hits=False), 200
+        )
+
+        results["add_memory"] = measure(lambda i: store.add_memory({
+            "id": str(uuid.uuid4()),
+            "timestamp": datetime.datetime.now().isoformat(),
+            "users": [user_ids[i % len(user_ids)]],
+            "user_names": {},
+            "content": f"{random_text(rng)} bench {i}",
+            "importance": "medium",
+            "tags": [],
+            "channel_id": channel_ids[0]
+        }), 200)
+
+        results["save_long_term_memory"] = measure(lambda i: store.save_long_term_memory(), heavy_runs)
+
+        delete_users = rng.sample(user_ids, min(50, len(user_ids)))
+        results["delete_user_memories"] = measure(
+            lambda i: store.delete_user_memories(delete_users[i]), len(delete_users)
+        )
+
+        results["archive_old_messages"] = measure(
+            lambda i: store.archive_old_messages(channel_ids[i % len(channel_ids)], history), 50
+        )
+
+        queries = [" ".join(text for _, _, text in parse_msg_tags(history[j]["content"]))
+                   for j in range(0, len(history), 2)]
+        results["fewshot_select"] = measure(
+            lambda i: fewshot_index.select(queries[i % len(queries)], FEWSHOT_TOKEN_BUDGET, FEWSHOT_MAX_EXAMPLES), 200
+        )
+
+        def build_prompt(i, cold):
+            """Giống process_channel_messages: fragments + few-shot + tóm tắt + history chưa tóm tắt"""
+            if cold:
+                store.fragment_cache.bump("memory")
+            buffer = [(f"user{uid[-4:]}", random_text(rng, 3, 15), uid, None) for uid in user_batches[i]]
+            combined_context, all_users, _ = format_context(buffer)
+            system = "SYSTEM PROMPT" + RESPONSE_RULES
+            system += store.build_context_fragments(channel_ids[i % len(channel_ids)], all_users)
+            fewshot_query = " ".join(text for _, _, text in parse_msg_tags(combined_context))
+            system += format_fewshot(fewshot_index.select(fewshot_query, FEWSHOT_TOKEN_BUDGET, FEWSHOT_MAX_EXAMPLES))
+            channel_summary, recent_history = split_history(history, summary_state, 60, SUMMARY_RAW_WINDOW)
+            return build_reply_messages(system, recent_history, combined_context, channel_summary)
+
+        results["build_prompt_cold"] = measure(lambda i: build_prompt(i, cold=True), 100)
+        results["build_prompt_warm"] = measure(lambda i: build_prompt(i % 10, cold=False), 200)
+
+        # Extract ký ức với LLM giả: parse JSON + thêm ký ức + save (như sau mỗi reply)
+        def extract_apply(i):
+            text, _ = llm.complete([{"role": "user", "content": history[-2]["content"]}], 300)
+            result = parse_json_loose(text)
+            store.add_extracted_memory(result, {user_ids[i]: f"user{user_ids[i][-4:]}"}, channel_ids[0])
+
+        results["extract_apply"] = measure(extract_apply, heavy_runs)
+
+    return results
+
+
+# ============================================
+# BASELINE
+# ============================================
+def compare(results, baseline, threshold, min_ms):
+    """List regression: (size, op, baseline_ms, now_ms)"""
+    regressions = []
+    for size, ops in results.items():
+        for op, stats in ops.items():
+            base = baseline.get("results", {}).get(size, {}).get(op)
+            if not base:
+                continue
+            # Thao tác quá nhanh thì nhiễu đo lớn hơn chênh lệch -> bỏ qua
+            if max(base["median_ms"], stats["median_ms"]) < min_ms:
+                continue
+            if stats["median_ms"] > base["median_ms"] * (1 + threshold):
+                regressions.append((size, op, base["median_ms"], stats["median_ms"]))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"{'SIZE':>8} {'OP':24} {'MEDIAN':>11} {'P95':>11} {'BASELINE':>11}")
+    for size, ops in results.items():
+        for op, stats in ops.items():
+            base = (baseline or {}).get("results", {}).get(size, {}).get(op)
+            base_text = f"{base['median_ms']:.3f}ms" if base else "-"
+            print(f"{size:>8} {op:24} {stats['median_ms']:>9.3f}ms {stats['p95_ms']:>9.3f}ms {base_text:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memory store va dung prompt")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="Ghi ket qua lam baseline moi")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Ti le cham hon baseline coi la regression")
+    parser.add_argument("--min-ms", type=float, default=0.05, help="Bo qua thao tac nhanh hon muc nay")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    results = {}
+    for size in sizes:
+        start = time.perf_counter()
+        results[str(size)] = bench_size(size)
+        print(f"[Bench] {size} memories: {time.perf_counter() - start:.1f}s")
+
+    report = {
+        "created_at": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print()
+    print_results(results, baseline)
+    print(f"\nDa ghi ket qua -> {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Da luu baseline -> {args.baseline}")
+        return
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        if regressions:
+            print(f"\nREGRESSION (cham hon baseline >{args.threshold:.0%}):")
+            for size, op, base_ms, now_ms in regressions:
+                print(f"  {size:>8} {op:24} {base_ms:.3f}ms -> {now_ms:.3f}ms (x{now_ms / base_ms:.2f})")
+            sys.exit(1)
+        print("Khong co regression so voi baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Export dataset - chuyen conversation_logs thanh du lieu fine-tune
+
+Doc tung dong cua conversation_logs/channel_*.jsonl (khong load ca file), bo
+metadata cua tag <msg>, loc cap hoi-dap kem chat luong, bo trung theo hash noi
+dung (Bloom filter kich thuoc co dinh -> bo nho khong doi du log nhieu GB) va
+ghi ra nhieu shard JSONL.
+
+Tin nhan cua user da !forget (purged_users.json) bi loai truoc khi export.
+
+Format:
+  finetune       {"messages": [{"role", "content"}, ...]}  (OpenAI fine-tuning)
+  conversations  {"id", "scenario", "conversation"}          (giong training_data/<CHARACTER>/conversations.json)
+
+Chay:
+  python export_dataset.py                               # -> dataset/train-00000.jsonl, ...
+  python export_dataset.py --format conversations --out-dir dataset_conv
+  python export_dataset.py --system "Ban la Gau Keo..." --max-turns 3 --shard-size 2000
+"""
+
+import os
+import json
+import sys
+import argparse
+import hashlib
+import math
+
+from message_tags import parse_msg_tags, filter_purged
+
+CONVERSATION_LOGS_DIR = "conversation_logs"
+
+
+class BloomFilter:
+    """Tập hash kích thước cố định - có thể báo trùng nhầm (tỉ lệ ~error_rate), không bao giờ bỏ sót"""
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001):
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hashes = max(int(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        """Thêm key, trả về True nếu key đã có (trùng)"""
+        seen = True
+        for pos in self._positions(key):
+            byte, bit = divmod(pos, 8)
+            if not self.bits[byte] & (1 << bit):
+                seen = False
+                self.bits[byte] |= 1 << bit
+        return seen
+
+
+def load_purged_users(logs_dir):
+    purged_file = os.path.join(logs_dir, "purged_users.json")
+    if os.path.exists(purged_file):
+        try:
+            with open(purged_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            pass
+    return {}
+
+
+# ============================================
+# CHUYỂN ĐỔI + LỌC
+# ============================================
+def clean_user_content(content):
+    """Batch <msg> -> nội dung thuần (bỏ user_id/name), mỗi tin một dòng"""
+    tags = parse_msg_tags(content)
+    if not tags:
+        return content.strip()
+    return "\n".join(text.strip() for _, _, text in tags if text.strip())
+
+
+def reply_drop_reason(reply, min_chars, max_chars):
+    """Lý do bỏ một reply của bot, None nếu giữ"""
+    text = reply.strip()
+    if text.startswith("[REACT:"):
+        return "react"
+    if text.startswith("Loi:"):
+        return "error"
+    if "<msg" in text:
+        return "metadata_leak"
+    if len(text) < min_chars:
+        return "too_short"
+    if len(text) > max_chars:
+        return "too_long"
+    return None
+
+
+def extract_pairs(messages, args, stats):
+    """List cặp (user, assistant) đã làm sạch từ messages của một log entry"""
+    pairs = []
+    pending_user = None
+    for msg in messages:
+        if msg["role"] == "user":
+            pending_user = clean_user_content(msg["content"])
+            continue
+        if pending_user is None:
+            continue
+        reason = None
+        if not pending_user:
+            reason = "empty_user"
+        elif len(pending_user) > args.max_chars:
+            reason = "too_long"
+        else:
+            reason = reply_drop_reason(msg["content"], args.min_chars, args.max_chars)
+        if reason:
+            stats["dropped"][reason] = stats["dropped"].get(reason, 0) + 1
+        else:
+            pairs.append((pending_user, msg["content"].strip()))
+        pending_user = None
+    return pairs
+
+
+def iter_examples(args, stats):
+    """Yield (channel_id, conversation) - đọc từng dòng, không giữ cả file trong bộ nhớ"""
+    purged = load_purged_users(args.logs_dir)
+    filenames = sorted(
+        name for name in os.listdir(args.logs_dir)
+        if name.startswith("channel_") and name.endswith(".jsonl")
+    ) if os.path.isdir(args.logs_dir) else []
+
+    for filename in filenames:
+        channel_id = filename[len("channel_"):-len(".jsonl")]
+        with open(os.path.join(args.logs_dir, filename), 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    stats["bad_lines"] += 1
+                    continue
+                stats["entries"] += 1
+                messages = filter_purged(entry.get("messages", []), entry.get("timestamp", ""), purged)
+                pairs = extract_pairs(messages, args, stats)
+
+                # Cắt thành các đoạn tối đa max_turns cặp hỏi-đáp
+                for start in range(0, len(pairs), args.max_turns):
+                    chunk = pairs[start:start + args.max_turns]
+                    if len(chunk) < args.min_turns:
+                        stats["dropped"]["too_few_turns"] = stats["dropped"].get("too_few_turns", 0) + 1
+                        continue
+                    conversation = []
+                    for user_text, reply in chunk:
+                        conversation.append({"role": "user", "content": user_text})
+                        conversation.append({"role": "assistant", "content": reply})
+                    yield channel_id, conversation
+
+
+def to_record(channel_id, conversation, index, args):
+    if args.format == "conversations":
+        return {
+            "id": f"log_{channel_id}_{index:06d}",
+            "scenario": {"topic": "", "category": "discord_log", "mood": ""},
+            "conversation": conversation
+        }
+    messages = [{"role": "system", "content": args.system}] if args.system else []
+    return {"messages": messages + conversation}
+
+
+# ============================================
+# GHI SHARD
+# ============================================
+class ShardWriter:
+    def __init__(self, out_dir, prefix, shard_size):
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.shard = -1
+        self.count = 0
+        self.file = None
+        self.paths = []
+        os.makedirs(out_dir, exist_ok=True)
+
+    def write(self, record):
+        if self.file is None or self.count >= self.shard_size:
+            self.close()
+            self.shard += 1
+            self.count = 0
+            path = os.path.join(self.out_dir, f"{self.prefix}-{self.shard:05d}.jsonl")
+            self.file = open(path, 'w', encoding='utf-8')
+            self.paths.append(path)
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export conversation_logs thanh dataset fine-tune")
+    parser.add_argument("--logs-dir", default=CONVERSATION_LOGS_DIR)
+    parser.add_argument("--out-dir", default="dataset")
+    parser.add_argument("--prefix", default="train")
+    parser.add_argument("--format", choices=("finetune", "conversations"), default="finetune")
+    parser.add_argument("--system", default="", help="System prompt them vao moi example (format finetune)")
+    parser.add_argument("--shard-size", type=int, default=5000, help="So example moi file")
+    parser.add_argument("--max-turns", type=int, default=4, help="So cap hoi-dap toi da moi example")
+    parser.add_argument("--min-turns", type=int, default=1)
+    parser.add_argument("--min-chars", type=int, default=3, help="Reply ngan hon -> bo")
+    parser.add_argument("--max-chars", type=int, default=2000, help="Tin/reply dai hon -> bo")
+    parser.add_argument("--dedupe-capacity", type=int, default=1_000_000,
+                        help="So example du kien (kich thuoc Bloom filter)")
+    args = parser.parse_args()
+
+    if args.max_turns < 1 or args.shard_size < 1:
+        print("--max-turns va --shard-size phai >= 1")
+        sys.exit(1)
+
+    stats = {"entries": 0, "bad_lines": 0, "examples": 0, "duplicates": 0, "dropped": {}}
+    seen = BloomFilter(capacity=args.dedupe_capacity)
+    writer = ShardWriter(args.out_dir, args.prefix, args.shard_size)
+    try:
+        for channel_id, conversation in iter_examples(args, stats):
+            key = json.dumps(conversation, ensure_ascii=False, sort_keys=True).encode("utf-8")
+            if seen.add(key):
+                stats["duplicates"] += 1
+                continue
+            writer.write(to_record(channel_id, conversation, stats["examples"], args))
+            stats["examples"] += 1
+    finally:
+        writer.close()
+
+    print(f"Doc {stats['entries']} log entries ({stats['bad_lines']} dong loi)")
+    print(f"Export {stats['examples']} examples, bo {stats['duplicates']} trung")
+    if stats["dropped"]:
+        print("Bo: " + ", ".join(f"{reason}={count}" for reason, count in sorted(stats["dropped"].items())))
+    for path in writer.paths:
+        print(f"  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Few-shot - chọn vài đoạn hội thoại mẫu liên quan nhất để chèn vào prompt
+
+Hội thoại mẫu trong training_data/<CHARACTER>/*conversations*.json (nhân vật
+không có file nào thì few-shot tắt) được cắt thành từng cặp hỏi-đáp và index
+sẵn lúc khởi động: chữ ký của mỗi cặp là tập từ của câu hỏi cộng với
+topic/category của scenario (trọng số gấp đôi). Mỗi từ
+được index cả dạng có dấu lẫn bỏ dấu: chat không dấu ("buon qua") vẫn khớp
+"buồn quá", còn khớp đúng dấu được điểm cao hơn ("đủ" không lẫn với "dữ"). Mỗi
+request chỉ tra inverted index, chấm điểm theo IDF và lấy 1-2 cặp tốt nhất
+không vượt budget token - giữ giọng nhân vật mà không tốn token như dump hết.
+"""
+
+import glob
+import json
+import math
+import os
+import re
+import unicodedata
+
+from memory_dedup import normalize_text
+
+SCENARIO_WEIGHT = 2.0  # Từ trong topic/category nặng hơn từ trong câu hỏi
+ACCENT_FREE_WEIGHT = 0.5  # Từ có dấu chỉ khớp sau khi bỏ dấu ("dữ" ~ "đủ") -> nhẹ hơn khớp đúng dấu
+ACCENT_FREE_PREFIX = "~"  # Key dạng bỏ dấu, tách khỏi key có dấu ("buon" gõ không dấu vs "~buon")
+
+
+def words_of(text):
+    return set(re.findall(r"\w+", unicodedata.normalize("NFC", text.lower())))
+
+
+def tokenize(text):
+    """Tập term để index: từ lowercase giữ dấu + dạng bỏ dấu (có prefix)
+
+    Chỉ so dạng bỏ dấu thì "đủ"/"dữ" hay "thế"/"thể" bị coi là một từ, chỉ so
+    dạng có dấu thì chat không dấu không khớp gì -> index cả hai.
+    """
+    words = words_of(text)
+    return words | {ACCENT_FREE_PREFIX + normalize_text(word) for word in words}
+
+
+class FewShotIndex:
+    def __init__(self, estimate_tokens, min_score=2.0, relative_cutoff=0.5):
+        self.estimate_tokens = estimate_tokens
+        self.min_score = min_score  # Điểm tối thiểu - dưới mức này coi như không liên quan
+        self.relative_cutoff = relative_cutoff  # Tỉ lệ tối thiểu so với điểm của ví dụ tốt nhất
+        self.exchanges = []  # [{"id", "category", "messages", "tokens"}]
+        self.postings = {}  # {term: {vị trí exchange: trọng số}}
+        self.idf = {}
+
+    def load(self, character_dir):
+        """Đọc mọi file *conversations*.json trong folder nhân vật (không có thì index rỗng)"""
+        paths = sorted(glob.glob(os.path.join(character_dir, "*conversations*.json")))
+        for path in paths:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    conversations = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"[FewShot] Khong doc duoc {path}: {e}")
+                continue
+            for conversation in conversations:
+                self.add_conversation(conversation)
+        self.build_idf()
+        if self.exchanges:
+            print(f"[FewShot] Index {len(self.exchanges)} cap hoi-dap tu {len(paths)} file")
+        return self
+
+    def add_conversation(self, conversation):
+        scenario = conversation.get("scenario", {})
+        # Topic/category là một phần của chữ ký: "Server lag issue" / "troubleshooting"
+        scenario_terms = tokenize(scenario.get("topic", "") + " " + scenario.get("category", "").replace("_", " "))
+
+        turns = conversation.get("conversation", [])
+        for user_msg, reply in zip(turns, turns[1:]):
+            if user_msg.get("role") != "user" or reply.get("role") != "assistant":
+                continue
+            messages = [{"role": "user", "content": user_msg["content"]},
+                        {"role": "assistant", "content": reply["content"]}]
+            position = len(self.exchanges)
+            self.exchanges.append({
+                "id": conversation.get("id", ""),
+                "category": scenario.get("category", ""),
+                "messages": messages,
+                "tokens": self.estimate_tokens(messages)
+            })
+            for term in tokenize(user_msg["content"]):
+                self.postings.setdefault(term, {})[position] = 1.0
+            for term in scenario_terms:
+                self.postings.setdefault(term, {})[position] = SCENARIO_WEIGHT
+
+    def build_idf(self):
+        total = len(self.exchanges)
+        self.idf = {term: math.log(1 + total / len(positions))
+                    for term, positions in self.postings.items()}
+
+    def match_word(self, word):
+        """Điểm của một từ trong query với từng exchange: lấy mức khớp tốt nhất
+
+        Từ gõ không dấu ("qua") khớp dạng bỏ dấu với trọng số đầy đủ vì không biết
+        người gõ muốn "qua" hay "quá"; từ có dấu khớp đúng dấu được điểm đầy đủ,
+        chỉ khớp sau khi bỏ dấu thì nhân ACCENT_FREE_WEIGHT.
+        """
+        stripped = normalize_text(word)
+        loose_term = ACCENT_FREE_PREFIX + stripped
+        accented = stripped != word
+        loose_weight = ACCENT_FREE_WEIGHT if accented else 1.0
+
+        scores = {}
+        for position, weight in self.postings.get(loose_term, {}).items():
+            scores[position] = self.idf[loose_term] * weight * loose_weight
+        if accented:
+            for position, weight in self.postings.get(word, {}).items():
+                scores[position] = max(scores.get(position, 0), self.idf[word] * weight)
+        return scores
+
+    def select(self, query, token_budget, max_examples=2):
+        """Các cặp hỏi-đáp liên quan nhất với query, tổng token <= token_budget
+
+        Mỗi hội thoại gốc chỉ lấy tối đa một cặp để ví dụ đa dạng hơn.
+        """
+        if not self.exchanges or token_budget <= 0 or max_examples <= 0:
+            return []
+
+        scores = {}
+        for word in words_of(query):
+            for position, score in self.match_word(word).items():
+                scores[position] = scores.get(position, 0) + score
+
+        if not scores:
+            return []
+        # Ví dụ sau phải đủ gần ví dụ tốt nhất, không lấy cho đủ số
+        cutoff = max(self.min_score, max(scores.values()) * self.relative_cutoff)
+        ranked = sorted(
+            (position for position, score in scores.items() if score >= cutoff),
+            key=lambda position: (-scores[position], self.exchanges[position]["tokens"])
+        )
+        selected = []
+        used_tokens = 0
+        used_ids = set()
+        for position in ranked:
+            exchange = self.exchanges[position]
+            if exchange["id"] in used_ids or used_tokens + exchange["tokens"] > token_budget:
+                continue
+            selected.append(exchange)
+            used_tokens += exchange["tokens"]
+            used_ids.add(exchange["id"])
+            if len(selected) >= max_examples:
+                break
+        return selected
@@ -0,0 +1,46 @@
+"""
+Fragment cache - cache các đoạn system prompt theo user/channel
+
+Mỗi slot (vd: ("user_info", user_id)) giữ một giá trị kèm version. Khi dữ liệu
+nguồn thay đổi, code gọi bump() để tăng version -> lần get() sau sẽ build lại.
+Slot không được dùng lâu sẽ bị bỏ khi vượt `max_entries` (LRU).
+"""
+
+from collections import OrderedDict
+
+
+class FragmentCache:
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # {slot: (version, value)}
+        self.versions = {}  # {key: int} - version của dữ liệu nguồn
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, key):
+        return self.versions.get(key, 0)
+
+    def bump(self, key):
+        """Dữ liệu nguồn `key` đã đổi"""
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def get(self, slot, version, build):
+        """Trả về giá trị của slot, gọi build() nếu chưa có hoặc version đã đổi"""
+        entry = self.entries.get(slot)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            self.entries.move_to_end(slot)
+            return entry[1]
+
+        self.misses += 1
+        value = build()
+        self.entries[slot] = (version, value)
+        self.entries.move_to_end(slot)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def format_stats(self):
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"Prompt cache: {self.hits} hit / {self.misses} miss ({rate:.0f}%), {len(self.entries)} fragments"
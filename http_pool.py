@@ -0,0 +1,123 @@
+"""
+HTTP pool - httpx client dùng chung cho OpenAI/Claude clients
+
+Cho phép chỉnh pool size, keep-alive, HTTP/2, timeout và đếm số request
+dùng lại connection cũ vs phải mở connection mới (TCP + TLS handshake).
+"""
+
+import time
+import httpx
+
+HTTP_STATS = {
+    "requests": 0,
+    "new_connections": 0,  # Request phải mở connection mới
+    "reused_connections": 0,  # Request dùng lại connection keep-alive
+    "http2_responses": 0,
+    "connect_seconds": 0.0  # Tổng thời gian TCP connect + TLS handshake
+}
+_warned_no_h2 = False  # Cảnh báo thiếu h2 chỉ in một lần dù tạo nhiều client
+
+
+def http2_available():
+    """HTTP/2 cần package h2 (pip install httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ConnectionTracer:
+    """Theo dõi một request qua trace extension của httpcore"""
+
+    def __init__(self):
+        self.new_connection = False
+        self.connect_started = None
+        self.connect_seconds = 0.0
+
+    def on_event(self, event_name, info):
+        if event_name.endswith("connect_tcp.started"):
+            self.new_connection = True
+            self.connect_started = time.perf_counter()
+        elif event_name.endswith(("connect_tcp.complete", "start_tls.complete")):
+            if self.connect_started is not None:
+                self.connect_seconds = time.perf_counter() - self.connect_started
+
+    def trace(self, event_name, info):
+        self.on_event(event_name, info)
+
+    async def trace_async(self, event_name, info):
+        self.on_event(event_name, info)
+
+
+def record_response(response):
+    tracer = response.request.extensions.get("pool_tracer")
+    HTTP_STATS["requests"] += 1
+    if response.http_version == "HTTP/2":
+        HTTP_STATS["http2_responses"] += 1
+    if tracer is None:
+        return
+    if tracer.new_connection:
+        HTTP_STATS["new_connections"] += 1
+        HTTP_STATS["connect_seconds"] += tracer.connect_seconds
+    else:
+        HTTP_STATS["reused_connections"] += 1
+
+
+def _on_request(request):
+    tracer = ConnectionTracer()
+    request.extensions["pool_tracer"] = tracer
+    request.extensions["trace"] = tracer.trace
+
+
+async def _on_request_async(request):
+    tracer = ConnectionTracer()
+    request.extensions["pool_tracer"] = tracer
+    request.extensions["trace"] = tracer.trace_async
+
+
+async def _on_response_async(response):
+    record_response(response)
+
+
+def build_http_client(async_mode=False, max_connections=20, max_keepalive=10,
+                      keepalive_expiry=60.0, http2=True, timeout=60.0, connect_timeout=5.0):
+    """Tạo httpx.Client / httpx.AsyncClient với pool và timeout đã chỉnh"""
+    global _warned_no_h2
+    if http2 and not http2_available():
+        if not _warned_no_h2:
+            print("[HTTP] Chua cai h2, dung HTTP/1.1 (pip install httpx[http2])")
+            _warned_no_h2 = True
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=keepalive_expiry
+    )
+    timeout = httpx.Timeout(timeout, connect=connect_timeout)
+
+    if async_mode:
+        return httpx.AsyncClient(
+            http2=http2,
+            limits=limits,
+            timeout=timeout,
+            event_hooks={"request": [_on_request_async], "response": [_on_response_async]}
+        )
+    return httpx.Client(
+        http2=http2,
+        limits=limits,
+        timeout=timeout,
+        event_hooks={"request": [_on_request], "response": [record_response]}
+    )
+
+
+def format_stats():
+    requests = HTTP_STATS["requests"]
+    reused = HTTP_STATS["reused_connections"]
+    new = HTTP_STATS["new_connections"]
+    reuse_rate = (reused / (reused + new) * 100) if (reused + new) else 0.0
+    avg_connect = (HTTP_STATS["connect_seconds"] / new * 1000) if new else 0.0
+    return (f"HTTP: {requests} requests, reuse {reuse_rate:.0f}% "
+            f"({reused} reused / {new} new, connect TB {avg_connect:.0f}ms), "
+            f"HTTP/2: {HTTP_STATS['http2_responses']}")
@@ -0,0 +1,102 @@
+"""
+Load shedding - bảo vệ pipeline reply khi traffic tăng đột biến
+
+- ReplyLimiter: giới hạn số request reply chạy cùng lúc (toàn bot). Khi hết slot
+  bot chuyển sang chế độ degraded (history ngắn, bỏ extract ký ức); khi hàng đợi
+  quá dài thì bỏ hẳn việc gọi API, chỉ thả emoji.
+- TokenLedger: đếm token theo channel/user trong cửa sổ thời gian để một channel
+  (hoặc user) spam không ăn hết quota của các channel khác.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+
+class ReplyLimiter:
+    def __init__(self, max_inflight=4, shed_queue_depth=8):
+        self.max_inflight = max(max_inflight, 1)
+        self.shed_queue_depth = shed_queue_depth
+        self.semaphore = None  # Tạo khi dùng lần đầu để gắn đúng event loop của bot
+        self.active = 0  # Request đang chạy
+        self.waiting = 0  # Channel đang chờ slot
+
+    def degraded(self):
+        """Hết slot trống -> request mới sẽ phải chờ"""
+        return self.active + self.waiting >= self.max_inflight
+
+    def shedding(self):
+        """Hàng đợi quá dài -> không gọi API nữa"""
+        return self.shed_queue_depth > 0 and self.waiting >= self.shed_queue_depth
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_inflight)
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+
+    def format_stats(self):
+        return f"Reply slots: {self.active}/{self.max_inflight} dang chay, {self.waiting} dang cho"
+
+
+class TokenLedger:
+    """Token đã dùng theo channel/user trong cửa sổ `window` giây (0 = không giới hạn budget)"""
+
+    def __init__(self, window=3600, channel_budget=0, user_budget=0):
+        self.window = window
+        self.channel_budget = channel_budget
+        self.user_budget = user_budget
+        self.window_start = time.monotonic()
+        self.channels = {}  # {channel_id: tokens trong cửa sổ hiện tại}
+        self.users = {}  # {user_id: tokens trong cửa sổ hiện tại}
+        self.channel_totals = {}  # Tổng từ lúc chạy bot
+        self.user_totals = {}
+
+    def _roll(self, now):
+        if now - self.window_start >= self.window:
+            self.window_start = now
+            self.channels = {}
+            self.users = {}
+
+    def record(self, channel_id, user_shares, tokens, now=None):
+        """Ghi nhận `tokens` cho channel, chia cho user theo tỉ lệ user_shares {user_id: trọng số}"""
+        now = time.monotonic() if now is None else now
+        self._roll(now)
+        self.channels[channel_id] = self.channels.get(channel_id, 0) + tokens
+        self.channel_totals[channel_id] = self.channel_totals.get(channel_id, 0) + tokens
+
+        total_weight = sum(user_shares.values())
+        if total_weight <= 0:
+            return
+        for user_id, weight in user_shares.items():
+            share = round(tokens * weight / total_weight)
+            self.users[user_id] = self.users.get(user_id, 0) + share
+            self.user_totals[user_id] = self.user_totals.get(user_id, 0) + share
+
+    def channel_over_budget(self, channel_id, now=None):
+        self._roll(time.monotonic() if now is None else now)
+        return self.channel_budget > 0 and self.channels.get(channel_id, 0) >= self.channel_budget
+
+    def user_over_budget(self, user_id, now=None):
+        self._roll(time.monotonic() if now is None else now)
+        return self.user_budget > 0 and self.users.get(user_id, 0) >= self.user_budget
+
+    def format_stats(self, top=3):
+        def top_items(counts):
+            items = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:top]
+            return ", ".join(f"{key}={tokens}" for key, tokens in items) or "-"
+
+        channel_budget = self.channel_budget or "khong gioi han"
+        user_budget = self.user_budget or "khong gioi han"
+        return (f"Token/{self.window // 60} phut - channel (budget {channel_budget}): {top_items(self.channels)}\n"
+                f"Token/{self.window // 60} phut - user (budget {user_budget}): {top_items(self.users)}")
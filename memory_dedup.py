@@ -0,0 +1,155 @@
+"""
+Memory dedup - phát hiện ký ức gần trùng khi thêm mới
+
+Mỗi ký ức có 2 chữ ký:
+- Hash của text đã chuẩn hóa (bỏ dấu, bỏ dấu câu, lowercase) -> trùng y hệt
+- MinHash (one-permutation: mỗi shingle chỉ hash 1 lần) trên tập từ + cặp từ
+  liên tiếp, tra qua LSH bands -> gần trùng
+
+Tra cứu chỉ so với các ký ức chung bucket (rồi tính Jaccard thật trên tập hash
+của shingle) nên chi phí gần như không đổi theo số lượng ký ức.
+
+Hai câu khác nhau ở con số ("ngày 5 tháng 3" / "ngày 5 tháng 4") hoặc ở từ phủ
+định ("thích" / "không thích") vẫn có Jaccard cao nhưng là hai sự thật khác
+nhau (hoặc là lời đính chính) -> không bao giờ coi là trùng.
+"""
+
+import hashlib
+import re
+import unicodedata
+
+EMPTY_SLOT = -1
+DENSIFY_OFFSET = 1 << 64  # Lớn hơn mọi giá trị slot để slot mượn không trùng slot thật
+NEGATION_WORDS = frozenset({"khong", "ko", "chua", "chang", "not", "never"})  # Sau normalize_text (đã bỏ dấu)
+
+
+def normalize_text(text):
+    """Chuẩn hóa để so sánh: bỏ dấu tiếng Việt, dấu câu, khoảng trắng thừa"""
+    text = text.lower().replace("đ", "d")
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def shingles(normalized):
+    """Tập từ đơn + cặp từ liên tiếp"""
+    words = normalized.split()
+    result = set(words)
+    result.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return result
+
+
+def conflict_key(normalized):
+    """Các con số và từ phủ định trong text - khác nhau thì không gộp dù giống nhau"""
+    words = normalized.split()
+    numbers = frozenset(word for word in words if word.isdigit())
+    negations = frozenset(word for word in words if word in NEGATION_WORDS)
+    return numbers, negations
+
+
+def shingle_hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class DedupIndex:
+    def __init__(self, num_slots=30, rows=3, threshold=0.7):
+        self.num_slots = num_slots
+        self.rows = rows
+        self.bands = num_slots // rows
+        self.threshold = threshold
+        self.exact = {}  # {hash text chuẩn hóa: set(mem_id)}
+        self.buckets = {}  # {(band, hash band): set(mem_id)}
+        self.entries = {}  # {mem_id: (exact_hash, signature, shingle_hashes, conflict_key)}
+
+    def signature(self, hashes):
+        """One-permutation MinHash: slot = h % num_slots, giữ giá trị nhỏ nhất mỗi slot
+
+        Slot rỗng (text ngắn) mượn giá trị slot kế tiếp theo vòng tròn
+        (rotation densification) để mọi band đều dùng được.
+        """
+        slots = [EMPTY_SLOT] * self.num_slots
+        for h in hashes:
+            slot = h % self.num_slots
+            value = h // self.num_slots
+            if slots[slot] == EMPTY_SLOT or value < slots[slot]:
+                slots[slot] = value
+        if EMPTY_SLOT in slots and any(v != EMPTY_SLOT for v in slots):
+            filled = list(slots)
+            for i in range(self.num_slots):
+                if slots[i] != EMPTY_SLOT:
+                    continue
+                distance = 1
+                while slots[(i + distance) % self.num_slots] == EMPTY_SLOT:
+                    distance += 1
+                filled[i] = slots[(i + distance) % self.num_slots] + distance * DENSIFY_OFFSET
+            slots = filled
+        return tuple(slots)
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            start = band * self.rows
+            rows = signature[start:start + self.rows]
+            # Band có slot rỗng sẽ trùng với mọi text ngắn -> bỏ qua
+            if EMPTY_SLOT not in rows:
+                yield (band, hash(rows))
+
+    def _fingerprint(self, text):
+        normalized = normalize_text(text)
+        exact_hash = hashlib.md5(normalized.encode("utf-8")).hexdigest()
+        hashes = frozenset(shingle_hash(s) for s in shingles(normalized))
+        return exact_hash, self.signature(hashes), hashes, conflict_key(normalized)
+
+    def add(self, mem_id, text):
+        exact_hash, signature, hashes, conflict = self._fingerprint(text)
+        self.entries[mem_id] = (exact_hash, signature, hashes, conflict)
+        self.exact.setdefault(exact_hash, set()).add(mem_id)
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, set()).add(mem_id)
+
+    def remove(self, mem_id):
+        entry = self.entries.pop(mem_id, None)
+        if entry is None:
+            return
+        exact_hash, signature, _, _ = entry
+        self.exact.get(exact_hash, set()).discard(mem_id)
+        for key in self._band_keys(signature):
+            self.buckets.get(key, set()).discard(mem_id)
+
+    def clear(self):
+        self.exact = {}
+        self.buckets = {}
+        self.entries = {}
+
+    def similarity(self, hashes_a, hashes_b):
+        """Jaccard trên tập hash của shingle"""
+        if not hashes_a or not hashes_b:
+            return 0.0
+        return len(hashes_a & hashes_b) / len(hashes_a | hashes_b)
+
+    def find(self, text, accept=None):
+        """Tìm ký ức gần trùng nhất với text
+
+        accept(mem_id) -> bool để lọc ứng viên (vd: khác user thì bỏ qua).
+        Trả về (mem_id, similarity) hoặc (None, 0.0).
+        """
+        exact_hash, signature, hashes, conflict = self._fingerprint(text)
+        for mem_id in self.exact.get(exact_hash, ()):
+            if accept is None or accept(mem_id):
+                return mem_id, 1.0
+
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self.buckets.get(key, ()))
+
+        best_id, best_score = None, 0.0
+        for mem_id in candidates:
+            if accept is not None and not accept(mem_id):
+                continue
+            _, _, candidate_hashes, candidate_conflict = self.entries[mem_id]
+            if candidate_conflict != conflict:
+                continue
+            score = self.similarity(hashes, candidate_hashes)
+            if score >= self.threshold and score > best_score:
+                best_id, best_score = mem_id, score
+        return best_id, best_score
@@ -0,0 +1,79 @@
+"""
+Memory retention - chấm điểm và chọn ký ức cần giảm cấp/đẩy ra cold archive
+
+Điểm = trọng số importance + độ mới (giảm dần theo half-life) + số lần được dùng.
+Mỗi user giữ tối đa `per_user_cap` ký ức, ký ức general (không có user) giữ tối
+đa `per_channel_cap` mỗi channel. Phần vượt cap có điểm thấp nhất bị evict.
+"""
+
+import datetime
+import math
+
+IMPORTANCE_WEIGHTS = {"high": 2.0, "medium": 1.0, "low": 0.5}
+HIT_WEIGHT = 0.5
+
+
+def parse_time(value):
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def score_memory(mem, now, half_life_days=30):
+    """Điểm giữ lại của một ký ức - càng cao càng nên giữ"""
+    importance = IMPORTANCE_WEIGHTS.get(mem.get("importance", "medium"), 1.0)
+
+    # Độ mới tính theo lần cuối được tạo/gộp hoặc được dùng trong prompt
+    last_seen = max(
+        (t for t in (parse_time(mem.get("timestamp")), parse_time(mem.get("last_hit"))) if t),
+        default=now
+    )
+    age_days = max((now - last_seen).total_seconds() / 86400, 0)
+    recency = 0.5 ** (age_days / half_life_days)
+
+    hits = math.log1p(mem.get("hits", 0)) * HIT_WEIGHT
+    return importance + recency + hits
+
+
+def plan_retention(memories, now=None, per_user_cap=50, per_channel_cap=100,
+                   half_life_days=30, demote_after_days=60):
+    """Chọn ký ức cần evict và cần giảm cấp
+
+    Ký ức có nhiều user chỉ bị evict khi nằm ngoài cap của TẤT CẢ user đó.
+    Ký ức "high" không được dùng trong `demote_after_days` ngày bị giảm về "medium".
+    Trả về (evict_ids, demote_ids).
+    """
+    now = now or datetime.datetime.now()
+    scores = {}
+    user_groups = {}
+    channel_groups = {}
+
+    for mem in memories:
+        if mem.get("deleted"):
+            continue
+        scores[mem["id"]] = score_memory(mem, now, half_life_days)
+        if mem.get("users"):
+            for uid in mem["users"]:
+                user_groups.setdefault(uid, []).append(mem["id"])
+        else:
+            channel_groups.setdefault(mem.get("channel_id"), []).append(mem["id"])
+
+    keep = set()
+    over_cap = set()
+    for groups, cap in ((user_groups, per_user_cap), (channel_groups, per_channel_cap)):
+        for mem_ids in groups.values():
+            mem_ids.sort(key=lambda mem_id: scores[mem_id], reverse=True)
+            keep.update(mem_ids[:cap])
+            over_cap.update(mem_ids[cap:])
+    evict_ids = over_cap - keep
+
+    demote_ids = set()
+    for mem in memories:
+        if mem.get("deleted") or mem["id"] in evict_ids or mem.get("importance") != "high":
+            continue
+        last_used = parse_time(mem.get("last_hit")) or parse_time(mem.get("timestamp"))
+        if last_used and (now - last_used).days >= demote_after_days:
+            demote_ids.add(mem["id"])
+
+    return evict_ids, demote_ids
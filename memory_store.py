@@ -0,0 +1,470 @@
+"""
+Memory store - long-term memory, user memories và log archive của bot
+
+Gom các thao tác bộ nhớ (trước đây là closure trong run_discord) vào một class
+để dùng lại được ở chỗ khác (vd: bench.py) mà không cần Discord hay API key.
+
+- long_term_memory: {"memories": [...], "last_optimized", "last_compressed", ...}
+- index: tra ký ức theo id/user không cần quét cả list; by_user[""] = general memories
+- Ký ức bị xóa chỉ được đánh dấu "deleted" (tombstone) và ghi append vào file
+  tombstone (replay khi load) - không ghi lại cả store; compaction mới xóa thật
+- fragment_cache: các đoạn system prompt; version: "memory", ("user", id), ("summary", channel_id)
+"""
+
+import os
+import json
+import datetime
+import uuid
+
+from memory_dedup import DedupIndex
+from memory_retention import plan_retention
+from fragment_cache import FragmentCache
+
+
+class MemoryStore:
+    def __init__(self, long_term_file="long_term_memory.json", memories_file="user_memories.json",
+                 logs_dir="conversation_logs", cold_file="long_term_memory_cold.jsonl",
+                 tombstone_file="long_term_memory_tombstones.jsonl", dedup_threshold=0.7, per_user_cap=50, per_channel_cap=100,
+                 half_life_days=30, demote_after_days=60):
+        self.long_term_file = long_term_file
+        self.memories_file = memories_file
+        self.logs_dir = logs_dir
+        self.cold_file = cold_file  # Ký ức bị evict bởi retention
+        self.tombstone_file = tombstone_file  # {"id", "deleted_at"} mỗi dòng - chưa compaction
+        self.per_user_cap = per_user_cap
+        self.per_channel_cap = per_channel_cap
+        self.half_life_days = half_life_days
+        self.demote_after_days = demote_after_days
+
+        self.long_term_memory = {"memories": [], "last_optimized": None, "last_compressed": None}
+        self.user_memories = {}
+        self.index = {"by_id": {}, "by_user": {}}
+        self.dedup = DedupIndex(threshold=dedup_threshold)  # Phát hiện ký ức gần trùng
+        self.fragment_cache = FragmentCache()
+
+    # ============================================
+    # LOAD / SAVE
+    # ============================================
+    def load(self):
+        """Đọc long-term memory, user memories từ file và dựng index"""
+        if not os.path.exists(self.logs_dir):
+            os.makedirs(self.logs_dir)
+
+        if os.path.exists(self.long_term_file):
+            try:
+                with open(self.long_term_file, 'r', encoding='utf-8') as f:
+                    self.long_term_memory = json.load(f)
+            except:
+                pass
+
+        if os.path.exists(self.memories_file):
+            try:
+                with open(self.memories_file, 'r', encoding='utf-8') as f:
+                    self.user_memories = json.load(f)
+            except:
+                pass
+
+        self.replay_tombstones()
+        self.rebuild_memory_index()
+
+    def save_long_term_memory(self):
+        with open(self.long_term_file, 'w', encoding='utf-8') as f:
+            json.dump(self.long_term_memory, f, ensure_ascii=False, indent=2)
+
+    def save_memories(self):
+        with open(self.memories_file, 'w', encoding='utf-8') as f:
+            json.dump(self.user_memories, f, ensure_ascii=False, indent=2)
+
+    def append_tombstones(self, memories):
+        """Ghi tombstone append-only - O(số ký ức bị xóa) thay vì ghi lại cả store"""
+        with open(self.tombstone_file, 'a', encoding='utf-8') as f:
+            for mem in memories:
+                f.write(json.dumps({"id": mem["id"], "deleted_at": mem["deleted_at"]}) + '\n')
+
+    def replay_tombstones(self):
+        """Áp các tombstone chưa được compaction ghi vào long_term_memory_file"""
+        if not os.path.exists(self.tombstone_file):
+            return
+        deleted = {}
+        with open(self.tombstone_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Dòng cuối ghi dở lúc crash
+                deleted[record["id"]] = record.get("deleted_at")
+        for mem in self.long_term_memory["memories"]:
+            if mem["id"] in deleted and not mem.get("deleted"):
+                mem["deleted"] = True
+                mem["deleted_at"] = deleted[mem["id"]]
+
+    def clear_tombstones(self):
+        """Store đã được ghi lại đầy đủ (kể cả cờ deleted) -> file tombstone không cần nữa"""
+        if os.path.exists(self.tombstone_file):
+            os.remove(self.tombstone_file)
+
+    def archive_old_messages(self, channel_id, old_messages):
+        """Lưu tin nhắn cũ vào file log để sau này xử lý"""
+        log_file = os.path.join(self.logs_dir, f"channel_{channel_id}.jsonl")
+
+        timestamp = datetime.datetime.now().isoformat()
+        log_entry = {
+            "timestamp": timestamp,
+            "messages": old_messages,
+            "processed": False  # Đánh dấu chưa nén/xử lý
+        }
+
+        # Append vào file (JSONL format - mỗi dòng là 1 JSON)
+        with open(log_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
+
+    # ============================================
+    # INDEX / THÊM / XÓA
+    # ============================================
+    def index_memory(self, mem):
+        self.index["by_id"][mem["id"]] = mem
+        for uid in mem.get("users") or [""]:
+            self.index["by_user"].setdefault(uid, []).append(mem["id"])
+        if not mem.get("deleted"):
+            self.dedup.add(mem["id"], mem["content"])
+
+    def rebuild_memory_index(self):
+        self.fragment_cache.bump("memory")
+        self.index["by_id"] = {}
+        self.index["by_user"] = {}
+        self.dedup.clear()
+        for mem in self.long_term_memory["memories"]:
+            self.index_memory(mem)
+
+    def merge_memory(self, existing, memory_entry):
+        """Gộp ký ức trùng vào ký ức cũ: lấy nội dung mới nhất, cập nhật thời gian, importance, tags, users"""
+        if existing["content"] != memory_entry["content"]:
+            # Bản mới có thể là lời đính chính/chi tiết hơn -> giữ bản mới, fingerprint lại
+            existing["content"] = memory_entry["content"]
+            self.dedup.remove(existing["id"])
+            self.dedup.add(existing["id"], existing["content"])
+        existing["timestamp"] = memory_entry["timestamp"]
+        if memory_entry.get("importance") == "high":
+            existing["importance"] = "high"
+        for tag in memory_entry.get("tags", []):
+            if tag not in existing.setdefault("tags", []):
+                existing["tags"].append(tag)
+        for uid in memory_entry.get("users", []):
+            if uid not in existing.setdefault("users", []):
+                existing["users"].append(uid)
+                self.index["by_user"].setdefault(uid, []).append(existing["id"])
+            if uid in memory_entry.get("user_names", {}):
+                existing.setdefault("user_names", {})[uid] = memory_entry["user_names"][uid]
+            if uid in memory_entry.get("original_names", {}):
+                existing.setdefault("original_names", {}).setdefault(uid, memory_entry["original_names"][uid])
+        existing["merge_count"] = existing.get("merge_count", 0) + 1
+        self.fragment_cache.bump("memory")
+
+    def add_memory(self, memory_entry):
+        """Thêm ký ức vào long-term memory (chưa save)
+
+        Nếu đã có ký ức gần trùng của cùng user (hoặc cùng là general) thì gộp
+        vào ký ức cũ thay vì thêm mới. Trả về ký ức được lưu.
+        """
+        new_users = set(memory_entry.get("users", []))
+
+        def same_scope(mem_id):
+            mem = self.index["by_id"].get(mem_id)
+            if mem is None or mem.get("deleted"):
+                return False
+            users = set(mem.get("users", []))
+            return (not users and not new_users) or bool(users & new_users)
+
+        dup_id, score = self.dedup.find(memory_entry["content"], accept=same_scope)
+        if dup_id:
+            existing = self.index["by_id"][dup_id]
+            self.merge_memory(existing, memory_entry)
+            print(f"[Dedup] Merged into {dup_id[:8]} ({score:.2f}): {memory_entry['content'][:50]}")
+            return existing
+
+        self.long_term_memory["memories"].append(memory_entry)
+        self.index_memory(memory_entry)
+        self.fragment_cache.bump("memory")
+        return memory_entry
+
+    def add_extracted_memory(self, result, user_info, channel_id):
+        """Lưu kết quả extract (JSON của memory curator), trả về True nếu là ký ức mới"""
+        memory_entry = {
+            "id": str(uuid.uuid4()),
+            "timestamp": datetime.datetime.now().isoformat(),
+            "users": list(user_info.keys()),
+            "user_names": user_info.copy(),  # Tên hiện tại (sẽ được update)
+            "original_names": user_info.copy(),  # Tên lúc tạo ký ức (không đổi)
+            "content": result["content"],
+            "importance": result.get("importance", "medium"),
+            "tags": result.get("tags", []),
+            "channel_id": channel_id
+        }
+        added = self.add_memory(memory_entry) is memory_entry
+        self.save_long_term_memory()
+        return added
+
+    def live_memories(self):
+        return [mem for mem in self.long_term_memory["memories"] if not mem.get("deleted")]
+
+    def tombstone_memory(self, mem):
+        self.fragment_cache.bump("memory")
+        self.dedup.remove(mem["id"])
+        mem["deleted"] = True
+        mem["deleted_at"] = datetime.datetime.now().isoformat()
+
+    def compact_memories(self):
+        """Xóa thật các ký ức đã tombstone và bỏ id của chúng khỏi index
+
+        Tombstone đã gỡ ký ức khỏi dedup nên không cần fingerprint lại cả store.
+        """
+        dead_ids = {mem["id"] for mem in self.long_term_memory["memories"] if mem.get("deleted")}
+        if not dead_ids:
+            return 0
+        self.long_term_memory["memories"] = self.live_memories()
+        for mem_id in dead_ids:
+            self.index["by_id"].pop(mem_id, None)
+        for uid in list(self.index["by_user"]):
+            mem_ids = [mem_id for mem_id in self.index["by_user"][uid] if mem_id not in dead_ids]
+            if mem_ids:
+                self.index["by_user"][uid] = mem_ids
+            else:
+                del self.index["by_user"][uid]
+        self.save_long_term_memory()
+        self.clear_tombstones()
+        print(f"[Compact] Removed {len(dead_ids)} deleted memories")
+        return len(dead_ids)
+
+    def delete_user_memories(self, user_id, description=None):
+        """Xóa ký ức liên quan đến user (tombstone, compaction sẽ xóa thật)"""
+        deleted = []
+
+        for mem_id in self.index["by_user"].get(user_id, []):
+            mem = self.index["by_id"].get(mem_id)
+            if mem is None or mem.get("deleted"):
+                continue
+
+            # Nếu có description, chỉ xóa ký ức match
+            if description and description.lower() not in mem.get("content", "").lower():
+                continue
+
+            self.tombstone_memory(mem)
+            deleted.append(mem)
+
+        if deleted:
+            self.append_tombstones(deleted)
+
+        return deleted
+
+    def purge_user_memories(self, user_id):
+        """Xóa user_memories và tombstone mọi ký ức có user (kể cả ký ức chung với người khác)
+
+        Trả về dict số lượng đã xóa.
+        """
+        counts = {"user_memories": 0, "long_term": 0}
+
+        if user_id in self.user_memories:
+            counts["user_memories"] = len(self.user_memories[user_id])
+            del self.user_memories[user_id]
+            self.save_memories()
+        self.fragment_cache.bump(("user", user_id))
+
+        deleted = []
+        for mem_id in self.index["by_user"].pop(user_id, []):
+            mem = self.index["by_id"].get(mem_id)
+            if mem is not None and not mem.get("deleted"):
+                self.tombstone_memory(mem)
+                deleted.append(mem)
+        if deleted:
+            self.append_tombstones(deleted)
+        counts["long_term"] = len(deleted)
+        return counts
+
+    def run_retention(self):
+        """Giảm cấp và đẩy ký ức điểm thấp ra cold archive, trả về báo cáo trước/sau"""
+        before_count = len(self.live_memories())
+        before_size = os.path.getsize(self.long_term_file) if os.path.exists(self.long_term_file) else 0
+
+        evict_ids, demote_ids = plan_retention(
+            self.long_term_memory["memories"],
+            per_user_cap=self.per_user_cap,
+            per_channel_cap=self.per_channel_cap,
+            half_life_days=self.half_life_days,
+            demote_after_days=self.demote_after_days
+        )
+
+        if demote_ids:
+            self.fragment_cache.bump("memory")
+        for mem_id in demote_ids:
+            mem = self.index["by_id"][mem_id]
+            mem["importance"] = "medium"
+            if "demoted" not in mem.setdefault("tags", []):
+                mem["tags"].append("demoted")
+
+        now = datetime.datetime.now().isoformat()
+        if evict_ids:
+            # Ghi cold archive trước rồi mới xóa khỏi store
+            with open(self.cold_file, 'a', encoding='utf-8') as f:
+                for mem_id in evict_ids:
+                    mem = self.index["by_id"][mem_id]
+                    f.write(json.dumps({**mem, "evicted_at": now}, ensure_ascii=False) + '\n')
+            for mem_id in evict_ids:
+                self.tombstone_memory(self.index["by_id"][mem_id])
+
+        self.long_term_memory["last_retention"] = now
+        if not self.compact_memories():
+            self.save_long_term_memory()
+
+        report = {
+            "before_count": before_count,
+            "after_count": len(self.live_memories()),
+            "before_bytes": before_size,
+            "after_bytes": os.path.getsize(self.long_term_file),
+            "evicted": len(evict_ids),
+            "demoted": len(demote_ids)
+        }
+        print(f"[Retention] {report['before_count']} -> {report['after_count']} memories "
+              f"({report['before_bytes']} -> {report['after_bytes']} bytes), "
+              f"evicted {report['evicted']}, demoted {report['demoted']}")
+        return report
+
+    # ============================================
+    # TRA CỨU
+    # ============================================
+    def get_relevant_memories(self, user_ids, current_names=None, limit=10, count_hits=True):
+        """Lấy ký ức liên quan đến users
+
+        Args:
+            user_ids: list of Discord user IDs
+            current_names: dict {user_id: current_display_name} để update tên mới
+            limit: số lượng memories tối đa
+            count_hits: ghi nhận lượt dùng cho retention
+        """
+        relevant = []
+        seen = set()
+        # Ký ức của các user + general memories (users rỗng), tra qua index
+        for uid in list(user_ids) + [""]:
+            for mem_id in self.index["by_user"].get(uid, []):
+                mem = self.index["by_id"].get(mem_id)
+                if mem is None or mem_id in seen or mem.get("deleted"):
+                    continue
+                seen.add(mem_id)
+                # Update display names nếu có tên mới
+                if current_names and uid:
+                    for mem_uid in mem.get("users", []):
+                        if mem_uid in current_names:
+                            mem["user_names"][mem_uid] = current_names[mem_uid]
+                relevant.append(mem)
+
+        # Sort by importance và timestamp
+        relevant.sort(key=lambda x: (
+            0 if x.get("importance") == "high" else 1,
+            x.get("timestamp", "")
+        ), reverse=True)
+
+        if count_hits:
+            self.record_memory_hits(relevant[:limit])
+
+        return relevant[:limit]
+
+    def record_memory_hits(self, memories):
+        """Đếm số lần được dùng - retention giữ lại ký ức hay được dùng"""
+        now = datetime.datetime.now().isoformat()
+        for mem in memories:
+            mem["hits"] = mem.get("hits", 0) + 1
+            mem["last_hit"] = now
+
+    def update_memory_names(self, current_names):
+        """Cập nhật tên hiển thị mới trong ký ức, trả về True nếu có thay đổi"""
+        changed = False
+        for uid, name in current_names.items():
+            for mem_id in self.index["by_user"].get(uid, []):
+                mem = self.index["by_id"].get(mem_id)
+                if mem is None or mem.get("deleted"):
+                    continue
+                if mem.setdefault("user_names", {}).get(uid) != name:
+                    mem["user_names"][uid] = name
+                    changed = True
+        if changed:
+            self.fragment_cache.bump("memory")  # Fragment ký ức đã cache còn tên cũ
+        return changed
+
+    # ============================================
+    # FRAGMENTS CHO SYSTEM PROMPT
+    # ============================================
+    def build_memory_fragment(self, user_ids, current_names):
+        """Đoạn LONG-TERM MEMORIES cho system prompt, trả về (text, memories)"""
+        # Update tên mới nếu user đổi display name
+        if self.update_memory_names(current_names):
+            self.save_long_term_memory()
+
+        relevant_memories = self.get_relevant_memories(user_ids, limit=10, count_hits=False)
+        if not relevant_memories:
+            return "", []
+
+        memories_lines = []
+        for mem in relevant_memories:
+            mem_text = f"- [{mem.get('importance', 'medium')}] {mem['content']}"
+            # Thêm info về tên cũ nếu đã đổi
+            original = mem.get('original_names', {})
+            current = mem.get('user_names', {})
+            name_changes = []
+            for uid in mem.get('users', []):
+                old_name = original.get(uid)
+                new_name = current.get(uid)
+                if old_name and new_name and old_name != new_name:
+                    name_changes.append(f"{old_name} -> {new_name}")
+            if name_changes:
+                mem_text += f" (ten cu: {', '.join(name_changes)})"
+            memories_lines.append(mem_text)
+
+        return "\n\nLONG-TERM MEMORIES:\n" + "\n".join(memories_lines), relevant_memories
+
+    def build_summary_fragment(self, channel_id):
+        """500 ký tự cuối của file summary cũ (chỉ đọc phần đuôi file)"""
+        summary_file = os.path.join(self.logs_dir, f"channel_{channel_id}_memories.txt")
+        if not os.path.exists(summary_file):
+            return ""
+        with open(summary_file, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 2048))  # 500 ký tự UTF-8 tối đa ~2000 bytes
+            old_memories = f.read().decode('utf-8', errors='ignore')
+        if not old_memories.strip():
+            return ""
+        return f"\n\nOLD MEMORIES:\n{old_memories[-500:]}"
+
+    def build_user_info_fragment(self, user_id, username):
+        if user_id not in self.user_memories or not self.user_memories[user_id]:
+            return ""
+        info = "\n".join([f"- {k}: {v}" for k, v in self.user_memories[user_id].items()])
+        return f"\n\nThong tin ve {username}:\n{info}"
+
+    def build_context_fragments(self, channel_id, all_users):
+        """Các đoạn system prompt theo user/channel - dùng lại từ cache nếu dữ liệu không đổi"""
+        user_ids = list(all_users.keys())
+        names = tuple(sorted(all_users.items()))
+        cache = self.fragment_cache
+
+        memory_text, memories = cache.get(
+            ("memories", names),
+            cache.version("memory"),
+            lambda: self.build_memory_fragment(user_ids, all_users)
+        )
+        self.record_memory_hits(memories)
+
+        summary_text = cache.get(
+            ("summary", channel_id),
+            cache.version(("summary", channel_id)),
+            lambda: self.build_summary_fragment(channel_id)
+        )
+
+        user_texts = [
+            cache.get(
+                ("user_info", user_id),
+                (cache.version(("user", user_id)), username),
+                lambda user_id=user_id, username=username: self.build_user_info_fragment(user_id, username)
+            )
+            for user_id, username in all_users.items()
+        ]
+
+        return memory_text + summary_text + "".join(user_texts)
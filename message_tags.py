@@ -0,0 +1,68 @@
+"""
+Message tags - xử lý tin nhắn dạng <msg user_id="..." name="...">nội dung</msg>
+
+Mỗi batch tin nhắn user gửi lên API là nhiều tag <msg> nối nhau bằng "\\n".
+Dùng chung cho bot.py và các tool offline đọc conversation_logs.
+"""
+
+import re
+
+MSG_PATTERN = re.compile(r'<msg user_id="(.*?)" name="(.*?)">(.*?)</msg>', re.DOTALL)
+
+
+def parse_msg_tags(content):
+    """Tách batch thành list (user_id, name, nội dung)"""
+    return MSG_PATTERN.findall(content)
+
+
+def msg_user_ids(history):
+    """Tập user_id xuất hiện trong history dạng [{role, content}]"""
+    user_ids = set()
+    for msg in history:
+        if msg["role"] == "user":
+            user_ids.update(user_id for user_id, _, _ in parse_msg_tags(msg["content"]))
+    return user_ids
+
+
+def strip_user_messages(content, user_id):
+    """Bỏ các tag <msg> của user_id khỏi một batch tin nhắn"""
+    pattern = re.compile(r'<msg user_id="' + re.escape(user_id) + r'" name=".*?">.*?</msg>\n?', re.DOTALL)
+    return pattern.sub("", content).strip()
+
+
+def strip_user_from_history(history, user_id):
+    """Bỏ tin nhắn của user khỏi history dạng [{role, content}]
+
+    Batch chỉ có tin của user đó bị bỏ cùng reply ngay sau nó.
+    Trả về (history mới, số message đã bỏ).
+    """
+    result = []
+    removed = 0
+    skip_reply = False
+    for msg in history:
+        if msg["role"] == "user":
+            skip_reply = False
+            if f'user_id="{user_id}"' in msg["content"]:
+                content = strip_user_messages(msg["content"], user_id)
+                if not content:
+                    removed += 1
+                    skip_reply = True
+                    continue
+                msg = {**msg, "content": content}
+        elif skip_reply:
+            removed += 1
+            skip_reply = False
+            continue
+        result.append(msg)
+    return result, removed
+
+
+def filter_purged(messages, timestamp, purged_users):
+    """Bỏ tin của user đã purge khỏi messages của một log entry
+
+    purged_users là {user_id: thời điểm purge}; chỉ entry archive trước lúc purge bị lọc.
+    """
+    for user_id, purged_at in purged_users.items():
+        if timestamp <= purged_at:
+            messages, _ = strip_user_from_history(messages, user_id)
+    return messages
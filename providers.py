@@ -0,0 +1,205 @@
+"""
+Providers - interface chung cho các model backend
+
+Mỗi provider có:
+  complete(messages, max_tokens, model=None, schema=None)   -> (text, usage)
+  acomplete(messages, max_tokens, model=None, schema=None)  -> (text, usage)  (async, hủy được)
+  warm_up() / awarm_up()                                    -> mở sẵn connection
+
+usage là dict {"prompt_tokens", "completion_tokens"}.
+schema = {"name", "description", "schema": JSON schema} bật structured output:
+OpenAI/local dùng response_format json_schema, Claude dùng tool use bắt buộc.
+Khi có schema, text trả về là JSON.
+"""
+
+import json
+import re
+
+
+def parse_json_loose(text):
+    """Parse JSON từ text của model một cách dễ dãi (fallback khi không có structured output)
+
+    Bỏ code fence, lấy đoạn từ "{" đầu tiên tới "}" cuối cùng, sửa dấu phẩy thừa.
+    Trả về dict hoặc None.
+    """
+    if not text:
+        return None
+    text = text.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?", "", text).rstrip("`").strip()
+
+    start_idx = text.find("{")
+    end_idx = text.rfind("}") + 1
+    if start_idx == -1 or end_idx == 0:
+        return None
+    text = text[start_idx:end_idx]
+
+    for candidate in (text, re.sub(r",\s*([}\]])", r"\1", text)):
+        try:
+            result = json.loads(candidate)
+            return result if isinstance(result, dict) else None
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def openai_response_format(schema):
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema["name"], "schema": schema["schema"], "strict": True}
+    }
+
+
+def claude_tool_params(schema):
+    return {
+        "tools": [{
+            "name": schema["name"],
+            "description": schema.get("description", ""),
+            "input_schema": schema["schema"]
+        }],
+        "tool_choice": {"type": "tool", "name": schema["name"]}
+    }
+
+
+def claude_text(content):
+    """Lấy text từ content blocks của Claude - tool_use thì trả về JSON của input"""
+    for block in content:
+        if block.type == "tool_use":
+            return json.dumps(block.input, ensure_ascii=False)
+    for block in content:
+        if block.type == "text":
+            return block.text
+    return ""
+
+
+def split_system(messages):
+    """Tách system message ra riêng (format của Claude)"""
+    system_content = ""
+    chat_messages = []
+    for msg in messages:
+        if msg["role"] == "system":
+            system_content += msg["content"] + "\n"
+        else:
+            chat_messages.append(msg)
+    return system_content.strip(), chat_messages
+
+
+class OpenAIProvider:
+    """OpenAI Chat Completions"""
+    name = "openai"
+
+    def __init__(self, client, async_client, model):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+
+    def _params(self, messages, max_tokens, model, schema=None):
+        params = {
+            "model": model or self.model,
+            "messages": messages,
+            "max_completion_tokens": max_tokens
+        }
+        if schema:
+            params["response_format"] = openai_response_format(schema)
+        return params
+
+    def _parse(self, response):
+        usage = {}
+        if response.usage:
+            usage = {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens
+            }
+        return response.choices[0].message.content or "", usage
+
+    def complete(self, messages, max_tokens, model=None, schema=None):
+        response = self.client.chat.completions.create(**self._params(messages, max_tokens, model, schema))
+        return self._parse(response)
+
+    async def acomplete(self, messages, max_tokens, model=None, schema=None):
+        response = await self.async_client.chat.completions.create(
+            **self._params(messages, max_tokens, model, schema)
+        )
+        return self._parse(response)
+
+    def warm_up(self):
+        self.client.models.list()
+
+    async def awarm_up(self):
+        await self.async_client.models.list()
+
+
+class LocalProvider(OpenAIProvider):
+    """Server local tương thích OpenAI (llama.cpp server, vLLM, Ollama /v1)"""
+    name = "local"
+
+    def _params(self, messages, max_tokens, model, schema=None):
+        # Server local thường chỉ hiểu max_tokens
+        params = {
+            "model": model or self.model,
+            "messages": messages,
+            "max_tokens": max_tokens
+        }
+        if schema:
+            params["response_format"] = openai_response_format(schema)
+        return params
+
+
+class ClaudeProvider:
+    """Anthropic Messages API"""
+    name = "claude"
+
+    def __init__(self, client, async_client, model):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+
+    def _params(self, messages, max_tokens, model, schema=None):
+        system_content, chat_messages = split_system(messages)
+        params = {
+            "model": model or self.model,
+            "max_tokens": max_tokens,
+            "system": system_content,
+            "messages": chat_messages
+        }
+        if schema:
+            params.update(claude_tool_params(schema))
+        return params
+
+    def _parse(self, response):
+        usage = {
+            "prompt_tokens": response.usage.input_tokens,
+            "completion_tokens": response.usage.output_tokens
+        }
+        return claude_text(response.content), usage
+
+    def complete(self, messages, max_tokens, model=None, schema=None):
+        response = self.client.messages.create(**self._params(messages, max_tokens, model, schema))
+        return self._parse(response)
+
+    async def acomplete(self, messages, max_tokens, model=None, schema=None):
+        response = await self.async_client.messages.create(**self._params(messages, max_tokens, model, schema))
+        return self._parse(response)
+
+    def warm_up(self):
+        self.client.models.list()
+
+    async def awarm_up(self):
+        await self.async_client.models.list()
+
+
+def parse_task_models(value):
+    """Parse TASK_MODELS: "extract=local:qwen2.5:3b,compress=local"
+
+    Trả về {task: (provider_name, model hoặc None)}. Chỉ tách ở dấu ":" đầu tiên
+    vì tên model của Ollama có thể chứa ":".
+    """
+    routes = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        task, target = item.split("=", 1)
+        provider_name, _, model = target.strip().partition(":")
+        if task.strip() and provider_name.strip():
+            routes[task.strip().lower()] = (provider_name.strip().lower(), model.strip() or None)
+    return routes
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Query logs - tra cuu conversation_logs qua index sidecar
+
+Moi file conversation_logs/channel_<id>.jsonl co mot file index
+channel_<id>.jsonl.idx (JSON) luu byte offset cua tung entry kem timestamp va
+user_id xuat hien trong entry. Index duoc cap nhat tang dan (chi doc phan moi
+append); neu file bi ghi lai (compaction sau !forget) thi build lai tu dau.
+Entry duoc doc bang mmap theo offset, khong can json.loads ca file.
+
+Tin nhan cua user da !forget (purged_users.json) luon bi loc khi doc.
+
+Chay:
+  python query_logs.py index [--channel ID]                    # Build/cap nhat index
+  python query_logs.py user USER_ID [--channel ID]             # Tin nhan cua mot user
+  python query_logs.py range START [END] [--channel ID]        # Entry trong khoang thoi gian
+  python query_logs.py export OUT.jsonl [--user ID] [--since T] [--until T] [--channel ID]
+  python query_logs.py stats [--channel ID]                    # Thong ke archive
+
+Thoi gian la ISO (vd: 2024-05-01 hoac 2024-05-01T12:00), END/--until tinh ca prefix.
+"""
+
+import os
+import json
+import sys
+import argparse
+import bisect
+import mmap
+import time
+
+from message_tags import parse_msg_tags, msg_user_ids, filter_purged
+
+CONVERSATION_LOGS_DIR = "conversation_logs"
+PURGED_USERS_FILE = os.path.join(CONVERSATION_LOGS_DIR, "purged_users.json")
+INDEX_VERSION = 1
+END_OF_PREFIX = "\uffff"  # "2024-05-01" + END_OF_PREFIX >= mọi timestamp trong ngày đó
+
+
+# ============================================
+# INDEX
+# ============================================
+# Index: {"version", "size": số byte đã index, "entries": [[offset, length, timestamp], ...],
+#         "users": {user_id: [vị trí entry, ...]}}
+
+def index_path(log_file):
+    return log_file + ".idx"
+
+
+def empty_index():
+    return {"version": INDEX_VERSION, "size": 0, "entries": [], "users": {}}
+
+
+def load_index(log_file):
+    path = index_path(log_file)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION:
+                return index
+        except (OSError, json.JSONDecodeError):
+            pass
+    return empty_index()
+
+
+def save_index(log_file, index):
+    path = index_path(log_file)
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_file, path)
+
+
+def open_mmap(log_file):
+    """mmap read-only; trả về None nếu file rỗng (mmap không map được file 0 byte)"""
+    if os.path.getsize(log_file) == 0:
+        return None
+    with open(log_file, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def index_is_valid(index, mm, size):
+    """Index còn khớp file không - file bị ghi lại thì entry cuối sẽ lệch"""
+    if size < index["size"]:
+        return False
+    if not index["entries"]:
+        return index["size"] == 0
+    offset, length, timestamp = index["entries"][-1]
+    if offset + length > size:
+        return False
+    try:
+        entry = json.loads(mm[offset:offset + length])
+    except ValueError:
+        return False
+    return entry.get("timestamp", "") == timestamp
+
+
+def update_index(log_file):
+    """Cập nhật index cho phần mới append; build lại nếu file đã bị ghi lại
+
+    Trả về (index, số entry mới).
+    """
+    index = load_index(log_file)
+    size = os.path.getsize(log_file)
+    mm = open_mmap(log_file)
+    try:
+        if mm is None or not index_is_valid(index, mm, size):
+            index = empty_index()
+        if size == index["size"]:
+            return index, 0
+
+        added = 0
+        offset = index["size"]
+        while mm is not None and offset < size:
+            end = mm.find(b"\n", offset)
+            if end == -1:
+                # Dòng cuối đang được ghi dở -> để lần sau
+                break
+            line = mm[offset:end]
+            if line.strip():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None
+                if entry is not None:
+                    position = len(index["entries"])
+                    index["entries"].append([offset, end - offset, entry.get("timestamp", "")])
+                    for user_id in msg_user_ids(entry.get("messages", [])):
+                        index["users"].setdefault(user_id, []).append(position)
+                    added += 1
+            offset = end + 1
+        index["size"] = offset
+    finally:
+        if mm is not None:
+            mm.close()
+
+    save_index(log_file, index)
+    return index, added
+
+
+# ============================================
+# ĐỌC ENTRY
+# ============================================
+def load_purged_users():
+    if os.path.exists(PURGED_USERS_FILE):
+        try:
+            with open(PURGED_USERS_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            pass
+    return {}
+
+
+def log_files(channel_id=None):
+    """List (channel_id, đường dẫn) các file log archive"""
+    if not os.path.isdir(CONVERSATION_LOGS_DIR):
+        return []
+    result = []
+    for filename in sorted(os.listdir(CONVERSATION_LOGS_DIR)):
+        if not (filename.startswith("channel_") and filename.endswith(".jsonl")):
+            continue
+        file_channel = filename[len("channel_"):-len(".jsonl")]
+        if channel_id is None or file_channel == str(channel_id):
+            result.append((file_channel, os.path.join(CONVERSATION_LOGS_DIR, filename)))
+    return result
+
+
+def select_positions(index, user_id=None, since=None, until=None):
+    """Vị trí các entry khớp điều kiện - timestamp tăng dần nên dùng bisect"""
+    timestamps = [entry[2] for entry in index["entries"]]
+    lo = bisect.bisect_left(timestamps, since) if since else 0
+    hi = bisect.bisect_right(timestamps, until + END_OF_PREFIX) if until else len(timestamps)
+    if user_id is None:
+        return range(lo, hi)
+    positions = index["users"].get(str(user_id), [])
+    return positions[bisect.bisect_left(positions, lo):bisect.bisect_left(positions, hi)]
+
+
+def read_entries(log_file, index, positions, purged):
+    """Đọc các entry theo offset qua mmap, đã lọc user bị purge"""
+    mm = open_mmap(log_file)
+    if mm is None:
+        return
+    try:
+        for position in positions:
+            offset, length, timestamp = index["entries"][position]
+            entry = json.loads(mm[offset:offset + length])
+            entry["messages"] = filter_purged(entry.get("messages", []), timestamp, purged)
+            yield entry
+    finally:
+        mm.close()
+
+
+def query(channel_id=None, user_id=None, since=None, until=None):
+    """Yield (channel_id, entry) khớp điều kiện trên mọi channel"""
+    purged = load_purged_users()
+    for file_channel, log_file in log_files(channel_id):
+        index, _ = update_index(log_file)
+        positions = select_positions(index, user_id, since, until)
+        for entry in read_entries(log_file, index, positions, purged):
+            yield file_channel, entry
+
+
+# ============================================
+# COMMANDS
+# ============================================
+def cmd_index(args):
+    files = log_files(args.channel)
+    if not files:
+        print("Khong co file log nao")
+        return
+    for file_channel, log_file in files:
+        start = time.perf_counter()
+        index, added = update_index(log_file)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"channel_{file_channel}: {len(index['entries'])} entries "
+              f"(+{added}), {len(index['users'])} users, {elapsed:.1f}ms")
+
+
+def cmd_user(args):
+    found = 0
+    for file_channel, entry in query(args.channel, user_id=args.user_id):
+        for msg in entry["messages"]:
+            if msg["role"] != "user":
+                continue
+            for user_id, name, content in parse_msg_tags(msg["content"]):
+                if user_id == str(args.user_id):
+                    print(f"[{entry['timestamp'][:19]}] #{file_channel} {name}: {content}")
+                    found += 1
+    print(f"-- {found} tin nhan")
+
+
+def cmd_range(args):
+    found = 0
+    for file_channel, entry in query(args.channel, since=args.start, until=args.end):
+        print(f"=== #{file_channel} {entry['timestamp'][:19]} ({len(entry['messages'])} messages) ===")
+        for msg in entry["messages"]:
+            if msg["role"] == "user":
+                for _, name, content in parse_msg_tags(msg["content"]):
+                    print(f"  {name}: {content}")
+            else:
+                print(f"  [bot]: {msg['content']}")
+        found += 1
+    print(f"-- {found} entries")
+
+
+def cmd_export(args):
+    count = 0
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for file_channel, entry in query(args.channel, args.user, args.since, args.until):
+            if not entry["messages"]:
+                continue
+            f.write(json.dumps({"channel_id": file_channel, **entry}, ensure_ascii=False) + '\n')
+            count += 1
+    print(f"Da export {count} entries -> {args.output}")
+
+
+def cmd_stats(args):
+    files = log_files(args.channel)
+    if not files:
+        print("Khong co file log nao")
+        return
+    print(f"{'CHANNEL':22} {'ENTRIES':>8} {'USERS':>6} {'SIZE':>10}  FIRST -> LAST")
+    total_entries = total_bytes = 0
+    for file_channel, log_file in files:
+        index, _ = update_index(log_file)
+        entries = index["entries"]
+        first = entries[0][2][:19] if entries else "-"
+        last = entries[-1][2][:19] if entries else "-"
+        size_kb = index["size"] / 1024
+        print(f"{file_channel:22} {len(entries):>8} {len(index['users']):>6} {size_kb:>8.1f}KB  {first} -> {last}")
+        total_entries += len(entries)
+        total_bytes += index["size"]
+    print(f"Tong: {len(files)} channels, {total_entries} entries, {total_bytes / 1024:.1f}KB")
+    purged = load_purged_users()
+    if purged:
+        print(f"User da purge (loc khi doc): {len(purged)}")
+
+
+# ============================================
+# MAIN
+# ============================================
+def main():
+    parser = argparse.ArgumentParser(description="Tra cuu conversation_logs qua index")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("index", help="Build/cap nhat index")
+    p.add_argument("--channel")
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser("user", help="Tin nhan cua mot user")
+    p.add_argument("user_id")
+    p.add_argument("--channel")
+    p.set_defaults(func=cmd_user)
+
+    p = sub.add_parser("range", help="Entry trong khoang thoi gian")
+    p.add_argument("start")
+    p.add_argument("end", nargs="?")
+    p.add_argument("--channel")
+    p.set_defaults(func=cmd_range)
+
+    p = sub.add_parser("export", help="Export entry ra file JSONL")
+    p.add_argument("output")
+    p.add_argument("--user")
+    p.add_argument("--since")
+    p.add_argument("--until")
+    p.add_argument("--channel")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("stats", help="Thong ke archive")
+    p.add_argument("--channel")
+    p.set_defaults(func=cmd_stats)
+
+    args = parser.parse_args()
+    if not args.command:
+        print(__doc__)
+        sys.exit(0)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Reply scheduler - quyết định chờ bao lâu trước khi trả lời một channel
+
+Thay cho sleep cố định 3 giây:
+- Chờ ít nhất `min_delay` sau tin nhắn cuối, học nhịp gõ của từng channel
+- Không bao giờ chờ quá `max_wait` tính từ tin nhắn đầu tiên trong batch
+- Trả lời ngay khi bot được mention/reply hoặc batch đạt `max_batch` tin nhắn
+"""
+
+import time
+
+# Hệ số EMA khi học nhịp gõ
+EMA_ALPHA = 0.2
+# Tỉ lệ tin nhắn "liên tiếp" dưới mức này -> channel vắng, trả lời nhanh
+BURST_THRESHOLD = 0.3
+# Chờ thêm bao nhiêu lần khoảng cách trung bình giữa 2 tin liên tiếp
+GAP_MULTIPLIER = 1.5
+
+
+class ReplyScheduler:
+    def __init__(self, min_delay=0.8, max_delay=3.0, max_wait=8.0, max_batch=8):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_wait = max(max_wait, min_delay)
+        self.max_batch = max_batch
+        self.channels = {}
+
+    def _state(self, channel_id):
+        if channel_id not in self.channels:
+            self.channels[channel_id] = {
+                "last_at": None,       # Tin nhắn gần nhất
+                "first_at": None,      # Tin nhắn đầu tiên của batch đang chờ
+                "gap_ema": self.max_delay / GAP_MULTIPLIER,  # Khoảng cách TB giữa tin liên tiếp
+                "burst_rate": 0.5,     # Tỉ lệ tin nhắn có tin khác theo sau nhanh
+                "urgent": False
+            }
+        return self.channels[channel_id]
+
+    def note_message(self, channel_id, urgent=False, now=None):
+        """Ghi nhận tin nhắn mới và cập nhật nhịp gõ của channel"""
+        now = time.monotonic() if now is None else now
+        state = self._state(channel_id)
+
+        if state["last_at"] is not None:
+            gap = now - state["last_at"]
+            # Tin đến trong cửa sổ gộp -> cùng một "đợt" gõ
+            in_burst = gap <= self.max_delay * 2
+            if in_burst:
+                state["gap_ema"] += EMA_ALPHA * (gap - state["gap_ema"])
+            state["burst_rate"] += EMA_ALPHA * ((1.0 if in_burst else 0.0) - state["burst_rate"])
+
+        state["last_at"] = now
+        if state["first_at"] is None:
+            state["first_at"] = now
+        if urgent:
+            state["urgent"] = True
+
+    def quiet_delay(self, channel_id):
+        """Khoảng lặng cần chờ sau tin nhắn cuối (đã học theo channel)"""
+        state = self._state(channel_id)
+        if state["burst_rate"] < BURST_THRESHOLD:
+            return self.min_delay
+        delay = state["gap_ema"] * GAP_MULTIPLIER
+        return min(max(delay, self.min_delay), self.max_delay)
+
+    def delay_for(self, channel_id, buffered_count, now=None):
+        """Số giây còn phải chờ trước khi xử lý batch (0 = xử lý ngay)"""
+        now = time.monotonic() if now is None else now
+        state = self._state(channel_id)
+        if state["first_at"] is None:
+            return 0.0
+        if state["urgent"] or buffered_count >= self.max_batch:
+            return 0.0
+
+        deadline = min(
+            state["last_at"] + self.quiet_delay(channel_id),
+            state["first_at"] + self.max_wait  # Giới hạn trên cho độ trễ
+        )
+        return max(0.0, deadline - now)
+
+    def take(self, channel_id):
+        """Batch đã được lấy ra xử lý - reset trạng thái chờ"""
+        state = self._state(channel_id)
+        state["first_at"] = None
+        state["urgent"] = False